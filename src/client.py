@@ -1,5 +1,8 @@
 import urllib.request
 import urllib.parse
+import urllib.error
+import urllib.response
+import http.client
 import http.cookiejar
 import mimetypes
 import uuid
@@ -7,57 +10,641 @@ import json
 import ssl
 import base64
 import os
+import shutil
 import time
-import gzip
+import random
+import zlib
 import io
 import logging
 import threading
-from typing import Optional, Dict, Union, Callable, Generator
+import select
+import socket
+import functools
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import email.utils
+from collections import OrderedDict
+from typing import Optional, Dict, Union, Callable, Generator, NamedTuple, Iterable, List
+
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which the stdlib encoder handles.
+            return json.dumps(obj).encode("utf-8")
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def _gunzip(data: bytes) -> bytes:
+    # A gzip body may hold several concatenated members, zlib stops after the first one.
+    parts = []
+    while data:
+        decoder = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        parts.append(decoder.decompress(data))
+        if not decoder.eof:
+            raise zlib.error("incomplete or truncated gzip stream")
+        data = decoder.unused_data
+    return b"".join(parts)
+
+
+def _decompress(data: bytes, encoding: str) -> bytes:
+    encoding = encoding.lower()
+    if not data:
+        return data
+    if "gzip" in encoding:
+        return _gunzip(data)
+    elif "deflate" in encoding:
+        # "deflate" is supposed to be zlib-wrapped, but some servers send a raw stream.
+        try:
+            return zlib.decompress(data, wbits=zlib.MAX_WBITS)
+        except zlib.error:
+            return zlib.decompress(data, wbits=-zlib.MAX_WBITS)
+    elif "br" in encoding and brotli is not None:
+        return brotli.decompress(data)
+    return data
+
+
+def _iter_decompressed(chunks, encoding: str, chunk_size: int):
+    encoding = encoding.lower()
+    if "gzip" in encoding:
+        decoder = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    elif "deflate" in encoding:
+        decoder = zlib.decompressobj(wbits=zlib.MAX_WBITS)
+    elif "br" in encoding and brotli is not None:
+        decoder = brotli.Decompressor()
+        for chunk in chunks:
+            data = decoder.process(chunk)
+            if data:
+                yield data
+        return
+    else:
+        yield from chunks
+        return
+
+    is_gzip = "gzip" in encoding
+    head = b""
+    for chunk in chunks:
+        if not is_gzip and head is not None:
+            # Same zlib-or-raw fallback as _decompress; the zlib header is 2 bytes, so wait for them.
+            head += chunk
+            if len(head) < 2:
+                continue
+            chunk, head = head, None
+            try:
+                data = decoder.decompress(chunk, chunk_size)
+            except zlib.error:
+                decoder = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+                data = decoder.decompress(chunk, chunk_size)
+        else:
+            data = decoder.decompress(chunk, chunk_size)
+        # max_length keeps every yielded piece (and memory) bounded by chunk_size.
+        while True:
+            if data:
+                yield data
+            if decoder.eof:
+                if not (is_gzip and decoder.unused_data):
+                    break
+                # Next member of a multi-member gzip body.
+                unused, decoder = decoder.unused_data, zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+                data = decoder.decompress(unused, chunk_size)
+            elif decoder.unconsumed_tail:
+                data = decoder.decompress(decoder.unconsumed_tail, chunk_size)
+            else:
+                break
+    if head:
+        data = decoder.decompress(head)
+        if data:
+            yield data
+    data = decoder.flush()
+    if data:
+        yield data
+
+
+@functools.lru_cache(maxsize=256)
+def _guess_mime(ext: str) -> Optional[str]:
+    return mimetypes.guess_type(f"file{ext}")[0]
+
+
+def _get_charset(content_type: str, default="utf-8") -> str:
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset":
+            return value.strip().strip('"\'') or default
+    return default
 
 
 class HttpResponse:
-    def __init__(self, status_code, text, headers, url, reason, raw_response=None, raw_bytes=None, cookies=None):
+    def __init__(self, status_code, headers, url, reason, raw_response=None, raw_bytes=None, cookies=None):
         self.status_code = status_code
-        self.text = text
+        self.ok = 200 <= status_code < 300
+        self.is_success = self.ok
+        self.is_redirect = 300 <= status_code < 400
+        self.is_client_error = 400 <= status_code < 500
+        self.is_server_error = 500 <= status_code < 600
         self.headers = dict(headers)
         self.url = url
         self.reason = reason
         self.raw_response = raw_response
         self.content = raw_bytes
         self.cookies = cookies or {}
+        self._content_encoding = headers.get("Content-Encoding", "")
+        self._content_type = headers.get("Content-Type", "")
+
+    @functools.cached_property
+    def _body(self) -> bytes:
+        return _decompress(self.content, self._content_encoding)
+
+    @functools.cached_property
+    def text(self) -> str:
+        try:
+            return self._body.decode(_get_charset(self._content_type))
+        except LookupError:
+            return self._body.decode()
 
     def json(self):
         try:
-            return json.loads(self.text)
+            return json.loads(self._body)
         except json.JSONDecodeError:
             return None
 
     def get_json_safe(self, default=None):
         try:
-            return json.loads(self.text)
+            return json.loads(self._body)
         except Exception:
             return default
 
-    @property
-    def ok(self):
-        return 200 <= self.status_code < 300
-
-    @property
-    def is_success(self):
-        return self.ok
-
     def raise_for_status(self):
         if not self.ok:
             raise Exception(f"HTTP {self.status_code} {self.reason}")
 
 
+class CacheEntry(NamedTuple):
+    status_code: int
+    reason: str
+    url: str
+    headers: tuple
+    content: bytes
+    expires: float
+    vary: tuple
+
+
+def _cache_directives(value: str) -> Dict[str, Optional[str]]:
+    directives = {}
+    for item in value.split(","):
+        name, _, arg = item.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def _expires_at(headers, now: float) -> float:
+    directives = _cache_directives(headers.get("Cache-Control", ""))
+    if "no-cache" in directives:
+        return now
+    if directives.get("max-age") is not None:
+        try:
+            return now + int(directives["max-age"]) - int(headers.get("Age") or 0)
+        except ValueError:
+            return now
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return email.utils.parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return now
+    return now
+
+
+def _vary_values(names, request_headers: Dict[str, str]) -> tuple:
+    lowered = {k.lower(): v for k, v in request_headers.items()}
+    return tuple((name, lowered.get(name, "")) for name in names)
+
+
+def _build_message(items) -> http.client.HTTPMessage:
+    message = http.client.HTTPMessage()
+    for name, value in items:
+        message[name] = value
+    return message
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteResponseCache:
+    def __init__(self, path: str, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored REAL, status_code INTEGER, "
+                "reason TEXT, url TEXT, headers TEXT, content BLOB, expires REAL, vary TEXT)"
+            )
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status_code, reason, url, headers, content, expires, vary FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        status_code, reason, url, headers, content, expires, vary = row
+        return CacheEntry(
+            status_code, reason, url, tuple(map(tuple, json.loads(headers))), content, expires, tuple(map(tuple, json.loads(vary)))
+        )
+
+    def set(self, key: str, entry: CacheEntry):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, time.time(), entry.status_code, entry.reason, entry.url, json.dumps(entry.headers), entry.content, entry.expires, json.dumps(entry.vary))
+            )
+            self._db.execute(
+                "DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY stored DESC LIMIT ?)", (self.max_entries,)
+            )
+
+    def delete(self, key: str):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses")
+
+    def close(self):
+        self._db.close()
+
+
+class MultipartBody:
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, parts):
+        # Parts are either literal bytes or paths of files to stream; adjacent bytes are merged
+        # so the headers of each part go out in a single send.
+        self._parts = []
+        for part in parts:
+            if isinstance(part, bytes) and self._parts and isinstance(self._parts[-1], bytes):
+                self._parts[-1] += part
+            else:
+                self._parts.append(part)
+        self._length = sum(len(part) if isinstance(part, bytes) else os.path.getsize(part) for part in self._parts)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            with open(part, "rb") as f:
+                while True:
+                    chunk = f.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+
 class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
     def redirect_request(self, req, fp, code, msg, headers, newurl):
         return None
 
 
+def _is_connection_dropped(conn) -> bool:
+    sock = conn.sock
+    if sock is None:
+        return True
+    try:
+        # An idle keep-alive socket is only readable if the peer closed it (or sent garbage).
+        # poll() has no FD_SETSIZE limit, select() is only the fallback where poll() is missing.
+        if hasattr(select, "poll"):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            return bool(poller.poll(0))
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+class PooledHTTPResponse(http.client.HTTPResponse):
+    _release = None
+
+    def close(self):
+        if self.fp is not None and self.length != 0:
+            # Body was not drained, the socket is out of sync and can't be reused.
+            self.will_close = True
+        super().close()
+
+    def _close_conn(self):
+        super()._close_conn()
+        release, self._release = self._release, None
+        if release:
+            release(not self.will_close)
+
+
+class DnsCache:
+    def __init__(self, ttl=300, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port) -> list:
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                return entry[0]
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        with self._lock:
+            self._entries[key] = (addresses, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return addresses
+
+    def invalidate(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        # Same contract as socket.create_connection, minus the getaddrinfo call on cache hits.
+        host, port = address
+        error = None
+        for family, type_, proto, _, sockaddr in self.resolve(host, port):
+            sock = None
+            try:
+                sock = socket.socket(family, type_, proto)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as e:
+                error = e
+                if sock is not None:
+                    sock.close()
+        self.invalidate(host, port)
+        if error is not None:
+            raise error
+        raise OSError(f"getaddrinfo returned no addresses for {host}")
+
+
+class ResumableHTTPSConnection(http.client.HTTPSConnection):
+    session: Optional[ssl.SSLSession] = None
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname, session=self.session)
+
+
+class ConnectionPool:
+    def __init__(self, ssl_context, max_keepalive_per_host=10, dns_cache: Optional[DnsCache] = None):
+        self.ssl_context = ssl_context
+        self.max_keepalive_per_host = max_keepalive_per_host
+        self.dns_cache = dns_cache or DnsCache()
+        self._lock = threading.Lock()
+        self._pools: Dict[tuple, list] = {}
+        self._sessions: Dict[tuple, ssl.SSLSession] = {}
+        self._closed = False
+
+    def _new_conn(self, key, timeout):
+        scheme, host, _ = key
+        if scheme == "https":
+            conn = ResumableHTTPSConnection(host, timeout=timeout, context=self.ssl_context)
+            conn.session = self._sessions.get(key)
+        else:
+            conn = http.client.HTTPConnection(host, timeout=timeout)
+        conn.response_class = PooledHTTPResponse
+        conn._create_connection = self.dns_cache.create_connection
+        return conn
+
+    def acquire(self, key, timeout):
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._pools.get(key)
+            while idle:
+                candidate = idle.pop()
+                if _is_connection_dropped(candidate):
+                    stale.append(candidate)
+                else:
+                    conn = candidate
+                    break
+        for candidate in stale:
+            candidate.close()
+        if conn is None:
+            return self._new_conn(key, timeout), False
+        conn.timeout = timeout
+        conn.sock.settimeout(timeout)
+        return conn, True
+
+    def release(self, key, conn, reusable):
+        if isinstance(conn.sock, ssl.SSLSocket) and conn.sock.session is not None:
+            # Read after the response so TLS 1.3 tickets sent post-handshake are included.
+            self._sessions[key] = conn.sock.session
+        if reusable and conn.sock is not None:
+            with self._lock:
+                # A closed pool (e.g. ssl_context reassigned mid-stream) keeps nothing.
+                idle = None if self._closed else self._pools.setdefault(key, [])
+                if idle is not None and len(idle) < self.max_keepalive_per_host:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            pools, self._pools = self._pools, {}
+            self._sessions.clear()
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+
+
+class KeepAliveHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    def __init__(self, pool: ConnectionPool):
+        super().__init__(context=pool.ssl_context)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self._open("http", req)
+
+    def https_open(self, req):
+        return self._open("https", req)
+
+    def _open(self, scheme, req):
+        if not req.host:
+            raise urllib.error.URLError("no host given")
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {name.title(): val for name, val in headers.items()}
+        tunnel_headers = {}
+        if req._tunnel_host and "Proxy-Authorization" in headers:
+            tunnel_headers["Proxy-Authorization"] = headers.pop("Proxy-Authorization")
+
+        key = (scheme, req.host, req._tunnel_host)
+        while True:
+            conn, reused = self.pool.acquire(key, req.timeout)
+            if req._tunnel_host and not reused:
+                conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+            try:
+                conn.request(req.get_method(), req.selector, req.data, headers,
+                             encode_chunked=req.has_header("Transfer-encoding"))
+                response = conn.getresponse()
+            except ConnectionError as e:
+                conn.close()
+                if reused:
+                    # The server dropped an idle keep-alive connection, retry on a fresh one.
+                    continue
+                raise urllib.error.URLError(e)
+            except OSError as e:
+                conn.close()
+                raise urllib.error.URLError(e)
+            except Exception:
+                conn.close()
+                raise
+            break
+
+        response._release = functools.partial(self.pool.release, key, conn)
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
+
+
+class _ResponseStream(io.RawIOBase):
+    def __init__(self, response):
+        self._response = response
+        self._chunks = response.iter_raw()
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = chunk
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self):
+        self._response.close()
+        super().close()
+
+
+def _ssl_settings(context: ssl.SSLContext) -> tuple:
+    return (
+        context.check_hostname, context.verify_mode, context.verify_flags, context.options,
+        context.minimum_version, context.maximum_version, tuple(context.cert_store_stats().values())
+    )
+
+
+def _copy_ssl_context(context: ssl.SSLContext, cert_chain: Optional[tuple] = None) -> ssl.SSLContext:
+    # SSLContext can't be cloned; carry over the verification settings and explicitly loaded CAs.
+    # A client certificate can't be read back either, so it is reloaded from cert_chain.
+    copy = ssl.create_default_context()
+    copy.check_hostname = context.check_hostname
+    copy.verify_mode = context.verify_mode
+    copy.verify_flags = context.verify_flags
+    copy.options = context.options
+    copy.minimum_version = context.minimum_version
+    copy.maximum_version = context.maximum_version
+    ca_certs = context.get_ca_certs(binary_form=True)
+    if ca_certs:
+        copy.load_verify_locations(cadata=b"".join(ca_certs))
+    if cert_chain:
+        copy.load_cert_chain(*cert_chain)
+    return copy
+
+
+class Http2Handler(urllib.request.BaseHandler):
+    # Runs ahead of KeepAliveHandler, which still serves plain HTTP.
+    handler_order = 499
+    CONNECTION_HEADERS = {"Connection", "Keep-Alive", "Proxy-Connection", "Transfer-Encoding", "Upgrade", "Host", "Proxy-Authorization"}
+
+    def __init__(self, transport, proxied=False):
+        self.transport = transport
+        self.proxied = proxied
+
+    def https_open(self, req):
+        if req._tunnel_host and not self.proxied:
+            # Proxy picked up from the environment, the transport doesn't know about it.
+            return None
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {name.title(): val for name, val in headers.items() if name.title() not in self.CONNECTION_HEADERS}
+        request = httpx.Request(
+            req.get_method(), req.get_full_url(), headers=headers, content=req.data,
+            extensions={"timeout": httpx.Timeout(req.timeout).as_dict()}
+        )
+        try:
+            response = self.transport.handle_request(request)
+        except httpx.TransportError as e:
+            raise urllib.error.URLError(e)
+
+        fp = io.BufferedReader(_ResponseStream(response), buffer_size=64 * 1024)
+        result = urllib.response.addinfourl(fp, _build_message(response.headers.multi_items()), req.get_full_url(), response.status_code)
+        result.reason = result.msg = response.reason_phrase
+        return result
+
+
 class HttpClient:
     RETRY_STATUSES = {429, 500, 502, 503, 504}
+    CACHEABLE_METHODS = {"GET", "HEAD"}
+    CACHEABLE_STATUSES = {200, 203, 300, 301, 410}
 
     def __init__(
         self,
@@ -69,25 +656,36 @@ class HttpClient:
         default_headers: Optional[Dict[str, str]] = None,
         max_retries=3,
         backoff_factor=1.0,
-        debug=False
+        debug=False,
+        max_keepalive_per_host=10,
+        cache: Optional[Union[ResponseCache, SQLiteResponseCache]] = None,
+        http_version="1.1"
     ):
+        if http_version not in ("1.1", "2"):
+            raise ValueError(f"Unsupported HTTP version: {http_version}")
         self.timeout = timeout
-        self.proxies = proxies
+        self._proxies = proxies
         self.auth = auth
-        self.follow_redirects = follow_redirects
-        self.ssl_context = ssl.create_default_context()
+        self._follow_redirects = follow_redirects
+        self._ssl_context = ssl.create_default_context()
+        self._cert_chain: Optional[tuple] = None
         self.cookie_jar = http.cookiejar.LWPCookieJar(cookie_file) if cookie_file else http.cookiejar.CookieJar()
         self.cookie_file = cookie_file
         self.default_headers = default_headers or {
             "User-Agent": "HttpClient/4.0",
-            "Accept-Encoding": "gzip, deflate",
+            "Accept-Encoding": "gzip, deflate, br" if brotli else "gzip, deflate",
             "Accept": "*/*",
             "Connection": "keep-alive"
         }
-        self.max_retries = max_retries
+        self._max_retries = max_retries
         self.backoff_factor = backoff_factor
         self.middleware = []
+        self.cache = cache
         self._lock = threading.Lock()
+        self._pool = ConnectionPool(self._ssl_context, max_keepalive_per_host)
+        self.http_version = http_version
+        self._http2_transport = self._build_http2_transport() if http_version == "2" else None
+        self._opener = self._build_opener()
 
         self.logger = logging.getLogger("HttpClient")
         self.logger.setLevel(logging.DEBUG if debug else logging.INFO)
@@ -98,22 +696,95 @@ class HttpClient:
         if self.cookie_file and os.path.exists(self.cookie_file):
             self.cookie_jar.load(ignore_discard=True)
 
+    @property
+    def max_retries(self) -> int:
+        return self._max_retries
+
+    @max_retries.setter
+    def max_retries(self, value: int):
+        self._max_retries = value
+        self._backoff_delays = tuple(self._backoff_factor * (1 << i) for i in range(value))
+
+    @property
+    def backoff_factor(self) -> float:
+        return self._backoff_factor
+
+    @backoff_factor.setter
+    def backoff_factor(self, value: float):
+        self._backoff_factor = value
+        self._backoff_delays = tuple(value * (1 << i) for i in range(self._max_retries))
+
+    @property
+    def auth(self) -> Optional[tuple]:
+        return self._auth
+
+    @auth.setter
+    def auth(self, value: Optional[tuple]):
+        self._auth = value
+        self._auth_header = None
+        if value:
+            user_pass = f"{value[0]}:{value[1]}"
+            self._auth_header = "Basic " + base64.b64encode(user_pass.encode()).decode()
+
+    @property
+    def proxies(self) -> Optional[Dict[str, str]]:
+        return self._proxies
+
+    @proxies.setter
+    def proxies(self, value: Optional[Dict[str, str]]):
+        self._proxies = value
+        self._rebuild_http2_transport()
+        self._opener = self._build_opener()
+
+    @property
+    def follow_redirects(self) -> bool:
+        return self._follow_redirects
+
+    @follow_redirects.setter
+    def follow_redirects(self, value: bool):
+        self._follow_redirects = value
+        self._opener = self._build_opener()
+
+    @property
+    def ssl_context(self) -> ssl.SSLContext:
+        return self._ssl_context
+
+    @ssl_context.setter
+    def ssl_context(self, value: ssl.SSLContext):
+        self._ssl_context = value
+        self._cert_chain = None
+        self._reset_connections()
+
+    def load_cert_chain(self, certfile, keyfile=None, password=None):
+        # Goes through the client rather than ssl_context so the HTTP/2 transport's copy gets it too.
+        self._ssl_context.load_cert_chain(certfile, keyfile, password)
+        self._cert_chain = (certfile, keyfile, password)
+        self._reset_connections()
+
+    def _reset_connections(self):
+        old_pool, self._pool = self._pool, ConnectionPool(self._ssl_context, self._pool.max_keepalive_per_host, self._pool.dns_cache)
+        old_pool.close()
+        self._rebuild_http2_transport()
+        self._opener = self._build_opener()
+
     def _log(self, *args):
-        self.logger.debug(" ".join(map(str, args)))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(" ".join(map(str, args)))
 
     def _log_request(self, method, url, headers):
-        self._log(f"=> {method} {url}")
-        for k, v in headers.items():
-            self._log(f"=> {k}: {v}")
-
-    def _log_response(self, response, text):
-        self._log(f"<= Status: {response.status} {response.reason}")
-        self._log(f"<= URL: {response.geturl()}")
-        self._log("<= Headers:")
-        for k, v in response.headers.items():
-            self._log(f"<= {k}: {v}")
-        short = text.strip()
-        self._log("<= Body:", short[:200] + ("..." if len(short) > 200 else ""))
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        self.logger.debug("=> %s %s", method, url)
+        self.logger.debug("=> Headers: %s", headers)
+
+    def _log_response(self, response, result):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        self.logger.debug("<= Status: %s %s", response.status, response.reason)
+        self.logger.debug("<= URL: %s", response.geturl())
+        self.logger.debug("<= Headers: %s", dict(response.headers))
+        short = result.text.strip()
+        self.logger.debug("<= Body: %s", short[:200] + ("..." if len(short) > 200 else ""))
 
     def add_middleware(self, fn: Callable):
         self.middleware.append(fn)
@@ -126,24 +797,56 @@ class HttpClient:
     def _build_opener(self):
         handlers = [
             urllib.request.HTTPCookieProcessor(self.cookie_jar),
-            urllib.request.HTTPSHandler(context=self.ssl_context)
+            KeepAliveHandler(self._pool)
         ]
         if self.proxies:
             handlers.append(urllib.request.ProxyHandler(self.proxies))
         if not self.follow_redirects:
             handlers.append(NoRedirectHandler())
+        if self._http2_transport is not None:
+            handlers.append(Http2Handler(self._http2_transport, proxied=bool(self.proxies and self.proxies.get("https"))))
         return urllib.request.build_opener(*handlers)
 
+    def _build_http2_transport(self):
+        if httpx is None:
+            raise ImportError("http_version='2' requires the optional 'httpx[http2]' package")
+        # httpx sets ALPN on the context it is given, so it gets a copy and the HTTP/1.1 pool
+        # never ends up offering h2.
+        proxy = self.proxies.get("https") if self.proxies else None
+        self._http2_ssl_settings = _ssl_settings(self._ssl_context)
+        return httpx.HTTPTransport(verify=_copy_ssl_context(self._ssl_context, self._cert_chain), http2=True, proxy=proxy)
+
+    def _rebuild_http2_transport(self):
+        if self._http2_transport is not None:
+            old_transport, self._http2_transport = self._http2_transport, self._build_http2_transport()
+            old_transport.close()
+
+    def _get_opener(self):
+        # ssl_context may have been edited in place since the HTTP/2 transport copied it.
+        if self._http2_transport is not None and _ssl_settings(self._ssl_context) != self._http2_ssl_settings:
+            with self._lock:
+                if _ssl_settings(self._ssl_context) != self._http2_ssl_settings:
+                    self._rebuild_http2_transport()
+                    self._opener = self._build_opener()
+        return self._opener
+
+    def close(self):
+        self._pool.close()
+        if self._http2_transport is not None:
+            self._http2_transport.close()
+
     def _build_headers(self, headers: Optional[Dict[str, str]]):
         final_headers = self.default_headers.copy()
         if headers:
             final_headers.update(headers)
-        if self.auth:
-            user_pass = f"{self.auth[0]}:{self.auth[1]}"
-            encoded = base64.b64encode(user_pass.encode()).decode()
-            final_headers["Authorization"] = f"Basic {encoded}"
+        if self._auth_header:
+            final_headers.setdefault("Authorization", self._auth_header)
         return final_headers
 
+    def _backoff(self, attempt):
+        # Jitter keeps clients that failed together from retrying in lockstep.
+        time.sleep(self._backoff_delays[attempt - 1] * (0.5 + random.random()))
+
     def _retry_request(self, func, *args, **kwargs):
         last_exception = None
         for attempt in range(1, self.max_retries + 1):
@@ -159,39 +862,92 @@ class HttpClient:
                 last_exception = e
                 if e.code not in self.RETRY_STATUSES:
                     raise e
-                time.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+                self._backoff(attempt)
             except Exception as e:
                 self._log(f"Retry {attempt}/{self.max_retries} failed:", e)
                 last_exception = e
-                time.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+                self._backoff(attempt)
         raise last_exception
 
-    def _decompress(self, response, data: bytes) -> str:
-        encoding = response.headers.get("Content-Encoding", "").lower()
-        if "gzip" in encoding:
-            return gzip.decompress(data).decode()
-        elif "deflate" in encoding:
-            return io.BytesIO(data).read().decode()
-        return data.decode()
-
     def _parse_cookies(self):
         return {cookie.name: cookie.value for cookie in self.cookie_jar}
 
+    def _cache_lookup(self, key: str, headers: Dict[str, str]) -> Optional[CacheEntry]:
+        entry = self.cache.get(key)
+        if entry is None or _vary_values((name for name, _ in entry.vary), headers) != entry.vary:
+            return None
+        return entry
+
+    def _cached_response(self, entry: CacheEntry) -> HttpResponse:
+        return HttpResponse(
+            entry.status_code, _build_message(entry.headers), entry.url, entry.reason, raw_bytes=entry.content, cookies=self._parse_cookies()
+        )
+
+    def _cache_store(self, key: str, result: HttpResponse, headers: Dict[str, str]):
+        if result.status_code not in self.CACHEABLE_STATUSES:
+            return
+        response_headers = result.raw_response.headers
+        vary = [name.strip().lower() for name in response_headers.get("Vary", "").split(",") if name.strip()]
+        if "no-store" in _cache_directives(response_headers.get("Cache-Control", "")) or "*" in vary:
+            return
+        now = time.time()
+        expires = _expires_at(response_headers, now)
+        if expires <= now and "ETag" not in response_headers and "Last-Modified" not in response_headers:
+            return
+        self.cache.set(key, CacheEntry(
+            result.status_code, result.reason, result.url, tuple(response_headers.items()), result.content, expires,
+            _vary_values(sorted(vary), headers)
+        ))
+
+    def _cache_refresh(self, key: str, entry: CacheEntry, not_modified: HttpResponse) -> HttpResponse:
+        message = _build_message(entry.headers)
+        updated = not_modified.raw_response.headers
+        for name in {k.lower(): k for k in updated.keys()}.values():
+            if name.lower() == "content-length":
+                continue
+            del message[name]
+            for value in updated.get_all(name):
+                message[name] = value
+        entry = entry._replace(headers=tuple(message.items()), expires=_expires_at(message, time.time()))
+        self.cache.set(key, entry)
+        return self._cached_response(entry)
+
     def _request(self, url: str, data: Optional[Union[bytes, dict]] = None, headers: Optional[Dict[str, str]] = None, method: str = "GET", timeout: Optional[int] = None) -> HttpResponse:
         headers = self._build_headers(headers)
         if isinstance(data, dict):
             content_type = headers.get("Content-Type", "").lower()
             if content_type == "application/json":
-                data = json.dumps(data).encode("utf-8")
+                data = _dumps(data)
             elif content_type == "application/x-www-form-urlencoded":
                 data = urllib.parse.urlencode(data).encode("utf-8")
             else:
                 headers["Content-Type"] = "application/json"
-                data = json.dumps(data).encode("utf-8")
+                data = _dumps(data)
+
+        method = method.upper()
+        cache_key = cached = None
+        if self.cache is not None:
+            request_directives = _cache_directives(headers.get("Cache-Control", ""))
+            if method not in self.CACHEABLE_METHODS:
+                for cacheable_method in self.CACHEABLE_METHODS:
+                    self.cache.delete(f"{cacheable_method} {url}")
+            elif "no-store" not in request_directives:
+                cache_key = f"{method} {url}"
+                if "no-cache" not in request_directives:
+                    cached = self._cache_lookup(cache_key, headers)
+                if cached is not None:
+                    if cached.expires > time.time():
+                        self._log("Cache hit:", url)
+                        return self._cached_response(cached)
+                    validators = _build_message(cached.headers)
+                    if "ETag" in validators:
+                        headers["If-None-Match"] = validators["ETag"]
+                    if "Last-Modified" in validators:
+                        headers["If-Modified-Since"] = validators["Last-Modified"]
 
-        req = urllib.request.Request(url, data=data, headers=headers, method=method.upper())
+        req = urllib.request.Request(url, data=data, headers=headers, method=method)
         req = self._apply_middleware(req)
-        opener = self._build_opener()
+        opener = self._get_opener()
 
         def do_open():
             try:
@@ -201,23 +957,29 @@ class HttpClient:
                 response = e
                 raw = e.read()
 
-            text = self._decompress(response, raw)
-            self._log_request(method, url, headers)
-            self._log_response(response, text)
-            return HttpResponse(
-                response.status, text, response.headers, response.geturl(), response.reason, response, raw_bytes=raw, cookies=self._parse_cookies()
+            result = HttpResponse(
+                response.status, response.headers, response.geturl(), response.reason, response, raw_bytes=raw, cookies=self._parse_cookies()
             )
+            self._log_request(method, url, headers)
+            self._log_response(response, result)
+            return result
 
-        with self._lock:
-            result = self._retry_request(do_open)
+        result = self._retry_request(do_open)
+
+        if cache_key is not None:
+            if result.status_code == 304 and cached is not None:
+                result = self._cache_refresh(cache_key, cached, result)
+            else:
+                self._cache_store(cache_key, result, headers)
 
         if self.cookie_file:
-            self.cookie_jar.save(ignore_discard=True)
+            with self._lock:
+                self.cookie_jar.save(ignore_discard=True)
         return result
 
     def get(self, url, params=None, headers=None, timeout=None):
         if params:
-            url += "?" + urllib.parse.urlencode(params)
+            url = f"{url}{'&' if '?' in url else '?'}{urllib.parse.urlencode(params, doseq=True)}"
         return self._request(url, headers=headers, method="GET", timeout=timeout)
 
     def post(self, url, data=None, headers=None, timeout=None):
@@ -239,62 +1001,95 @@ class HttpClient:
     def head(self, url, headers=None, timeout=None):
         return self._request(url, headers=headers, method="HEAD", timeout=timeout)
 
-    def download(self, url, dest_path, timeout=None):
-        def do_download():
-            req = urllib.request.Request(url, method="GET", headers=self._build_headers({}))
-            opener = self._build_opener()
-            with opener.open(req, timeout=timeout or self.timeout) as response:
-                with open(dest_path, "wb") as out_file:
-                    out_file.write(response.read())
-            self._log("Downloaded:", dest_path)
+    async def aget(self, url, params=None, headers=None, timeout=None):
+        return await asyncio.to_thread(self.get, url, params=params, headers=headers, timeout=timeout)
 
-        with self._lock:
-            self._retry_request(do_download)
+    async def apost(self, url, data=None, headers=None, timeout=None):
+        return await asyncio.to_thread(self.post, url, data=data, headers=headers, timeout=timeout)
+
+    async def aput(self, url, data=None, headers=None, timeout=None):
+        return await asyncio.to_thread(self.put, url, data=data, headers=headers, timeout=timeout)
+
+    async def apatch(self, url, data=None, headers=None, timeout=None):
+        return await asyncio.to_thread(self.patch, url, data=data, headers=headers, timeout=timeout)
+
+    async def adelete(self, url, headers=None, timeout=None):
+        return await asyncio.to_thread(self.delete, url, headers=headers, timeout=timeout)
+
+    async def ahead(self, url, headers=None, timeout=None):
+        return await asyncio.to_thread(self.head, url, headers=headers, timeout=timeout)
+
+    def _dispatch(self, request: Dict) -> HttpResponse:
+        request = dict(request)
+        method = request.pop("method", "GET").lower()
+        if method not in ("get", "post", "put", "patch", "delete", "head"):
+            raise ValueError(f"Unsupported method: {method.upper()}")
+        return getattr(self, method)(**request)
+
+    def map(self, requests: Iterable[Dict], concurrency=10) -> List[HttpResponse]:
+        # Each request is a dict of keyword arguments for the matching method, plus "method" (default GET).
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(self._dispatch, requests))
+
+    async def amap(self, requests: Iterable[Dict], concurrency=10) -> List[HttpResponse]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(request):
+            async with semaphore:
+                return await asyncio.to_thread(self._dispatch, request)
+
+        return await asyncio.gather(*(send(request) for request in requests))
+
+    def download(self, url, dest_path, timeout=None):
+        self._retry_request(self.download_stream, url, dest_path, chunk_size=1024 * 1024, timeout=timeout)
 
     def download_stream(self, url, dest_path, chunk_size=8192, timeout=None, progress_callback: Optional[Callable[[int], None]] = None):
         req = urllib.request.Request(url, method="GET", headers=self._build_headers({}))
-        opener = self._build_opener()
+        opener = self._get_opener()
         with opener.open(req, timeout=timeout or self.timeout) as response, open(dest_path, "wb") as out_file:
-            downloaded = 0
-            while True:
-                chunk = response.read(chunk_size)
-                if not chunk:
-                    break
-                out_file.write(chunk)
-                downloaded += len(chunk)
-                if progress_callback:
+            if progress_callback is None:
+                shutil.copyfileobj(response, out_file, chunk_size)
+            else:
+                downloaded = 0
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    out_file.write(chunk)
+                    downloaded += len(chunk)
                     progress_callback(downloaded)
         self._log("Stream downloaded:", dest_path)
 
     def post_multipart(self, url, fields: Dict[str, str], file_paths: Dict[str, str], headers=None):
         boundary = uuid.uuid4().hex
-        body = b""
+        parts = []
         for key, val in fields.items():
-            body += f"--{boundary}\r\n".encode()
-            body += f'Content-Disposition: form-data; name="{key}"\r\n\r\n{val}\r\n'.encode()
+            parts.append(f"--{boundary}\r\n".encode())
+            parts.append(f'Content-Disposition: form-data; name="{key}"\r\n\r\n{val}\r\n'.encode())
 
         for key, filepath in file_paths.items():
             filename = os.path.basename(filepath)
-            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
-            with open(filepath, "rb") as f:
-                content = f.read()
-            body += f"--{boundary}\r\n".encode()
-            body += f'Content-Disposition: form-data; name="{key}"; filename="{filename}"\r\n'.encode()
-            body += f"Content-Type: {mimetype}\r\n\r\n".encode()
-            body += content + b"\r\n"
-
-        body += f"--{boundary}--\r\n".encode()
+            mimetype = _guess_mime(os.path.splitext(filename)[1].lower())
+            if mimetype is None:
+                # Compound suffixes like .tar.gz only resolve on the full name.
+                mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            parts.append(f"--{boundary}\r\n".encode())
+            parts.append(f'Content-Disposition: form-data; name="{key}"; filename="{filename}"\r\n'.encode())
+            parts.append(f"Content-Type: {mimetype}\r\n\r\n".encode())
+            parts.append(filepath)
+            parts.append(b"\r\n")
+
+        parts.append(f"--{boundary}--\r\n".encode())
+        body = MultipartBody(parts)
         headers = self._build_headers(headers or {})
         headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+        headers["Content-Length"] = str(len(body))
 
         return self._request(url, data=body, headers=headers, method="POST")
 
     def stream_response(self, url, chunk_size=8192, timeout=None) -> Generator[bytes, None, None]:
         req = urllib.request.Request(url, method="GET", headers=self._build_headers({}))
-        opener = self._build_opener()
+        opener = self._get_opener()
         with opener.open(req, timeout=timeout or self.timeout) as response:
-            while True:
-                chunk = response.read(chunk_size)
-                if not chunk:
-                    break
-                yield chunk
+            chunks = iter(functools.partial(response.read, chunk_size), b"")
+            yield from _iter_decompressed(chunks, response.headers.get("Content-Encoding", ""), chunk_size)